@@ -1,5 +1,7 @@
+import hashlib
+from html import escape
 import streamlit as st
-from rag_core import RAGIndex, RetrievalMethod, build_answer_from_evidence
+from rag_core import PageCache, RAGIndex, RetrievalMethod, build_answer_from_evidence
 from utils import highlight_terms, pretty_source
 from pathlib import Path
 
@@ -28,6 +30,32 @@ st.markdown(
 
 st.divider()
 
+
+@st.cache_resource(show_spinner=False)
+def _page_cache() -> PageCache:
+    # sha1(pdf bytes) -> extracted page texts, shared across sessions. Extraction doesn't
+    # depend on chunk size/overlap, so changing those only re-runs chunking + vectorizing.
+    return PageCache()
+
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _build_cached_index(file_digests: tuple, _files: tuple, chunk_size: int, chunk_overlap: int,
+                        _force: bool = False) -> RAGIndex:
+    # Keyed by (name, sha1) pairs + chunking params; the raw bytes in _files are not hashed by Streamlit.
+    # A forced rebuild clears just its own key first, then re-seeds it, so the fresh index is
+    # shared with other sessions using the same corpus and their other entries are untouched.
+    # Built indexes are also persisted under .ragcache/ so a server restart can skip vectorizing.
+    idx = RAGIndex(chunk_size=chunk_size, chunk_overlap=chunk_overlap, cache_dir=".ragcache")
+    page_cache = _page_cache()
+    if _force:
+        # Re-extract these PDFs too; the fresh pages replace the cached ones
+        for _, digest in file_digests:
+            page_cache.discard(digest)
+    idx.add_pdfs_from_bytes(_files, page_cache=page_cache, parallel=True)
+    idx.build(force=_force)
+    return idx
+
+
 # ---------- Session state ----------
 if "index" not in st.session_state:
     st.session_state.index = None
@@ -35,6 +63,11 @@ if "corpus_name" not in st.session_state:
     st.session_state.corpus_name = "Unnamed corpus"
 if "last_results" not in st.session_state:
     st.session_state.last_results = {}
+if "experiment_results" not in st.session_state:
+    # (qid, method value) -> results from the last Tab 2 run, reused by "Inspect retrieved chunks"
+    st.session_state.experiment_results = {}
+if "experiment_rows" not in st.session_state:
+    st.session_state.experiment_rows = []
 
 # ---------- Sidebar (Control Panel) ----------
 with st.sidebar:
@@ -70,12 +103,15 @@ with st.sidebar:
     st.subheader("Actions")
     build_clicked = st.button("🔧 Build / Rebuild Index", type="primary", use_container_width=True)
     clear_clicked = st.button("🧹 Clear Index", use_container_width=True)
+    force_rebuild = st.checkbox("Force rebuild (ignore cached indexes)", value=False)
 
     st.caption("Tip: After indexing, use the tabs to ask questions, run mini experiments, and explore the corpus.")
 
 if clear_clicked:
     st.session_state.index = None
     st.session_state.last_results = {}
+    st.session_state.experiment_results = {}
+    st.session_state.experiment_rows = []
     st.toast("Index cleared.", icon="🧹")
 
 # ---------- Index build ----------
@@ -84,13 +120,24 @@ if build_clicked:
         st.error("Please upload at least one PDF before building the index.")
     else:
         with st.spinner("Indexing PDFs… (extracting text, chunking, building TF-IDF)"):
-            idx = RAGIndex(
-                chunk_size=int(chunk_size),
-                chunk_overlap=int(chunk_overlap),
+            # Sort by (name, digest) so upload order doesn't change the cache key
+            files = []
+            for uf in uploaded:
+                data = uf.getvalue()
+                files.append((uf.name, hashlib.sha1(data).hexdigest(), data))
+            files.sort(key=lambda f: (f[0], f[1]))
+            key_args = (
+                tuple((name, digest) for name, digest, _ in files),
+                tuple((name, data) for name, _, data in files),
+                int(chunk_size),
+                int(chunk_overlap),
             )
-            idx.add_pdfs(uploaded)
-            idx.build()
+            if force_rebuild:
+                _build_cached_index.clear(*key_args)
+            idx = _build_cached_index(*key_args, _force=force_rebuild)
             st.session_state.index = idx
+            st.session_state.experiment_results = {}
+            st.session_state.experiment_rows = []
         st.success(f"Indexed {idx.stats()['documents']} PDFs • {idx.stats()['chunks']} chunks")
 
 index: RAGIndex | None = st.session_state.index
@@ -235,9 +282,11 @@ with tab2:
         run_eval = st.button("▶ Run Experiment", type="primary")
         if run_eval:
             rows = []
+            st.session_state.experiment_results = {}
             for qid, qtext in default_queries.items():
                 for m in [RetrievalMethod.SPARSE, RetrievalMethod.TFIDF]:
                     res = index.search(qtext, top_k=int(k_eval), method=m)
+                    st.session_state.experiment_results[(qid, m.value)] = res
                     # Heuristic relevance judgement: if query's key terms appear, or contains hallmark phrase
                     # This is for demo — in a real study you'd label manually.
                     joined = " ".join([r["text"].lower() for r in res])
@@ -254,20 +303,30 @@ with tab2:
                         f"Recall@{k_eval}": "✅ Yes" if relevant else "❌ No",
                         "Top chunk": pretty_source(res[0]) if res else "—",
                     })
+            st.session_state.experiment_rows = rows
+            st.session_state.experiment_queries = dict(default_queries)
+            st.session_state.experiment_k = int(k_eval)
+
+        # Rendered from session state so the selectboxes below don't need a re-run (or a re-search)
+        if st.session_state.experiment_rows:
+            exp_queries = st.session_state.experiment_queries
+            exp_k = st.session_state.experiment_k
 
             # Display as a compact table
-            st.dataframe(rows, use_container_width=True, hide_index=True)
+            st.dataframe(st.session_state.experiment_rows, use_container_width=True, hide_index=True)
 
             st.markdown("### Inspect retrieved chunks")
-            pick_q = st.selectbox("Question", list(default_queries.keys()), index=0)
+            pick_q = st.selectbox("Question", list(exp_queries.keys()), index=0)
             pick_m = st.selectbox("Method", [RetrievalMethod.SPARSE.value, RetrievalMethod.TFIDF.value], index=0)
             method_map = {RetrievalMethod.SPARSE.value: RetrievalMethod.SPARSE, RetrievalMethod.TFIDF.value: RetrievalMethod.TFIDF}
 
-            res = index.search(default_queries[pick_q], top_k=int(k_eval), method=method_map[pick_m])
+            res = st.session_state.experiment_results.get((pick_q, pick_m))
+            if res is None:
+                res = index.search(exp_queries[pick_q], top_k=exp_k, method=method_map[pick_m])
             for i, item in enumerate(res, start=1):
                 st.markdown(f"**Rank {i}** • {pretty_source(item)} • score={item['score']:.3f}")
                 st.markdown(
-                    f"<div style='border-left:4px solid rgba(0,0,0,0.15); padding:8px 10px; background:rgba(0,0,0,0.02); border-radius:8px;'>{highlight_terms(item['text'], default_queries[pick_q])}</div>",
+                    f"<div style='border-left:4px solid rgba(0,0,0,0.15); padding:8px 10px; background:rgba(0,0,0,0.02); border-radius:8px;'>{highlight_terms(item['text'], exp_queries[pick_q])}</div>",
                     unsafe_allow_html=True
                 )
                 st.code(item["citation"], language="text")
@@ -292,11 +351,22 @@ with tab3:
         doc_chunks = index.get_chunks_for_document(pick_doc)
 
         st.caption("Showing chunk boundaries and citations (page-level if available).")
+        # One markdown payload for all chunks (one element instead of ~5 per chunk).
+        # No blank lines inside: markdown would end the HTML block there, hence <br/> for newlines.
+        parts = [
+            "<style>"
+            ".rag-chunk-head{margin-top:14px; margin-bottom:6px;}"
+            ".rag-chunk{border:1px solid rgba(0,0,0,0.08); padding:10px 12px; border-radius:10px; background:rgba(0,0,0,0.015);}"
+            ".rag-cite{margin:8px 0 0 0; padding:6px 10px; border-radius:8px; background:rgba(0,0,0,0.04); font-size:13px; white-space:pre-wrap;}"
+            ".rag-sep{border:none; border-top:1px solid rgba(0,0,0,0.1); margin:14px 0 0 0;}"
+            "</style>"
+        ]
         for ch in doc_chunks[:200]:  # guard for huge corpora
-            st.markdown(f"**{ch['chunk_id']}** • p.{ch.get('page', '—')} • {Path(ch['source']).name}")
-            st.markdown(
-                f"<div style='border:1px solid rgba(0,0,0,0.08); padding:10px 12px; border-radius:10px; background:rgba(0,0,0,0.015);'>{ch['text']}</div>",
-                unsafe_allow_html=True
+            text = escape(ch["text"]).replace("\n", "<br/>")
+            parts.append(
+                f"<div class='rag-chunk-head'><b>{escape(ch['chunk_id'])}</b> • p.{ch.get('page', '—')} • {escape(Path(ch['source']).name)}</div>"
+                f"<div class='rag-chunk'>{text}</div>"
+                f"<pre class='rag-cite'><code>{escape(ch['citation'])}</code></pre>"
+                "<hr class='rag-sep'/>"
             )
-            st.code(ch["citation"], language="text")
-            st.divider()
+        st.markdown("".join(parts), unsafe_allow_html=True)
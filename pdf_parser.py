@@ -3,13 +3,40 @@ from typing import List
 
 def extract_pdf_pages_text(uploaded_file) -> List[str]:
     """
-    Extract text per page from a Streamlit UploadedFile (PDF).
+    Extract text per page from a Streamlit UploadedFile (PDF) or raw PDF bytes.
     Returns a list of page strings. If extraction fails, returns [""].
+    Backends are tried in order: PyMuPDF (fast, C-backed), PyPDF2, pdfminer.
     """
-    data = uploaded_file.read()
-    # Reset pointer so Streamlit can re-read if needed
+    if isinstance(uploaded_file, (bytes, bytearray)):
+        data = bytes(uploaded_file)
+    else:
+        data = uploaded_file.read()
+        # Reset pointer so Streamlit can re-read if needed
+        try:
+            uploaded_file.seek(0)
+        except Exception:
+            pass
+
     try:
-        uploaded_file.seek(0)
+        try:
+            import pymupdf as fitz
+        except ImportError:
+            import fitz  # PyMuPDF < 1.24.3
+        doc = fitz.open(stream=data, filetype="pdf")
+        try:
+            # Text blocks only (images skipped: TEXT_PRESERVE_IMAGES is not in the default
+            # TEXTFLAGS_BLOCKS), one blank line between blocks so the chunker can pack
+            # paragraphs instead of cutting mid-sentence
+            pages = [
+                "\n\n".join(
+                    b[4] for b in doc.load_page(i).get_text("blocks", flags=fitz.TEXTFLAGS_BLOCKS)
+                    if b[6] == 0
+                )
+                for i in range(doc.page_count)
+            ]
+        finally:
+            doc.close()
+        return pages if pages else [""]
     except Exception:
         pass
 
@@ -1,7 +1,16 @@
 from __future__ import annotations
+from collections import OrderedDict, defaultdict
 from dataclasses import dataclass
 from enum import Enum
-from typing import List, Dict, Any, Iterable
+from typing import List, Dict, Any, Iterable, Protocol
+from concurrent.futures import ProcessPoolExecutor
+import functools
+import multiprocessing
+import hashlib
+import os
+import sys
+import tempfile
+import threading
 import re
 import math
 
@@ -9,6 +18,16 @@ from pdf_parser import extract_pdf_pages_text
 from retrievers import SparseKeywordRetriever, TfidfRetriever
 from utils import make_citation
 
+# Precompiled patterns for the per-chunk / per-sentence helpers below
+_PARA_RE = re.compile(r"\n\s*\n")
+_SAFE_ID_RE = re.compile(r"[^a-zA-Z0-9]+")
+_SENT_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z0-9(])")
+_TOK_RE = re.compile(r"[a-zA-Z]+")
+# Bump when the pickled index layout or retriever internals change, to orphan old cache files
+_CACHE_VERSION = 4
+# Most recently used index files kept in cache_dir; older ones are deleted after each save
+_CACHE_MAX_FILES = 8
+
 
 class RetrievalMethod(str, Enum):
     SPARSE = "Sparse (Keyword overlap)"
@@ -23,78 +42,227 @@ class Chunk:
     text: str
 
 
+class PageStore(Protocol):
+    # What add_pdfs_from_bytes needs from page_cache: a plain dict or a PageCache both fit
+    def get(self, key: str, default: Any = None) -> List[str] | None: ...
+    def __setitem__(self, key: str, pages: List[str]) -> None: ...
+
+
+class PageCache:
+    # Small thread-safe LRU (sha1 -> pages) for add_pdfs_from_bytes. The Streamlit app
+    # shares one across sessions, so it must stay bounded.
+    def __init__(self, max_entries: int = 64):
+        self._max = max_entries
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def __setitem__(self, key, pages):
+        with self._lock:
+            self._data[key] = pages
+            self._data.move_to_end(key)
+            while len(self._data) > self._max:
+                self._data.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
 class RAGIndex:
     """
     A small, research-oriented index:
     - Extract per-page text from PDFs
-    - Chunk with overlap
+    - Chunk by paragraph blocks (sliding window with overlap for oversized paragraphs)
     - Provide two retrieval baselines: sparse keyword overlap + TF-IDF
+    - Optionally persist built indexes under cache_dir, keyed by a digest of the chunks
     """
-    def __init__(self, chunk_size: int = 1200, chunk_overlap: int = 200):
+    def __init__(self, chunk_size: int = 1200, chunk_overlap: int = 200, cache_dir: str | None = None):
         self.chunk_size = int(chunk_size)
         self.chunk_overlap = int(chunk_overlap)
+        self.cache_dir = cache_dir
         self._chunks: List[Chunk] = []
-        self._docs: List[str] = []
+        self._doc_order: List[str] = []  # unique document names, insertion order
+        self._doc_set: set[str] = set()
+        self._docs_sorted: List[str] | None = None
+        self._chunks_by_doc: Dict[str, List[Chunk]] = defaultdict(list)
         self._built = False
         self._sparse = None
         self._tfidf = None
+        self._search_cached = None
 
     def add_pdfs(self, uploaded_files: Iterable):
-        # uploaded_files are Streamlit UploadedFile objects
+        # uploaded_files are Streamlit UploadedFile objects (not picklable),
+        # so read them into (name, bytes) pairs before handing off to workers.
+        # Only Streamlit produces these, so the process pool is safe (see add_pdfs_from_bytes).
+        self.add_pdfs_from_bytes([(uf.name, uf.getvalue()) for uf in uploaded_files], parallel=True)
+
+    def add_pdfs_from_bytes(self, files: Iterable, page_cache: PageStore | None = None,
+                            parallel: bool = False):
+        # files are (name, pdf_bytes) pairs.
+        # page_cache (sha1 of bytes -> pages) lets callers keep the expensive extraction
+        # across rebuilds with different chunking; only cache misses are extracted.
+        # Anything with get() and item assignment works (see PageStore); the app passes a PageCache.
+        # parallel=True extracts in a process pool. Pool workers re-import the caller's
+        # __main__, so only opt in when it is import-safe: under `streamlit run` it is the
+        # CLI launcher (not app.py); a plain script needs an `if __name__ == "__main__"` guard.
+        files = list(files)
         self._chunks = []
-        self._docs = []
-        for uf in uploaded_files:
-            name = uf.name
-            self._docs.append(name)
-            pages = extract_pdf_pages_text(uf)
-            # Make chunks per page so we can cite page numbers
-            for page_idx, page_text in enumerate(pages, start=1):
-                for j, t in enumerate(_chunk_text(page_text, self.chunk_size, self.chunk_overlap), start=1):
-                    chunk_id = f"{_safe_id(name)}-p{page_idx}-c{j:03d}"
-                    self._chunks.append(Chunk(
-                        chunk_id=chunk_id,
-                        source=name,
-                        page=page_idx,
-                        text=t.strip()
-                    ))
-
-    def build(self):
-        texts = [c.text for c in self._chunks]
-        metas = [{"chunk_id": c.chunk_id, "source": c.source, "page": c.page} for c in self._chunks]
-
-        self._sparse = SparseKeywordRetriever(texts=texts, metas=metas)
-        self._tfidf = TfidfRetriever(texts=texts, metas=metas)
+        self._reset_docs()
+        pages_per_file = _extract_pages_many([data for _, data in files], page_cache, parallel=parallel)
+        for (name, _), pages in zip(files, pages_per_file):
+            self.add_pages(name, pages)
+
+    def add_pages(self, name: str, pages: List[str]):
+        # Make chunks per page so we can cite page numbers
+        self._add_doc(name)
+        doc_chunks = self._chunks_by_doc[name]
+        for page_idx, page_text in enumerate(pages, start=1):
+            for j, t in enumerate(_chunk_text(page_text, self.chunk_size, self.chunk_overlap), start=1):
+                chunk_id = f"{_safe_id(name)}-p{page_idx}-c{j:03d}"
+                chunk = Chunk(
+                    chunk_id=chunk_id,
+                    source=name,
+                    page=page_idx,
+                    text=t.strip()
+                )
+                self._chunks.append(chunk)
+                doc_chunks.append(chunk)
+
+    def _reset_docs(self):
+        self._doc_order = []
+        self._doc_set = set()
+        self._docs_sorted = None
+        self._chunks_by_doc = defaultdict(list)
+
+    def _add_doc(self, name: str):
+        if name not in self._doc_set:
+            self._doc_set.add(name)
+            self._doc_order.append(name)
+            self._docs_sorted = None
+
+    def build(self, force: bool = False):
+        path = None
+        if self.cache_dir:
+            path = os.path.join(self.cache_dir, f"{self.corpus_digest()}.joblib")
+            if not force and os.path.exists(path):
+                try:
+                    self._set_state(_load_state(path))
+                    os.utime(path)  # mark as recently used for _prune_cache
+                    return
+                except Exception:
+                    pass  # unreadable / stale cache file: rebuild and overwrite it
+
+        # Both retrievers share self._chunks; no per-retriever text or metadata copies
+        self._sparse = SparseKeywordRetriever(self._chunks)
+        self._tfidf = TfidfRetriever(self._chunks)
+        # Per-instance LRU over (query, top_k, method); a rebuild starts a fresh cache.
+        # Streamlit reruns and the experiment tab re-issue identical searches.
+        self._search_cached = functools.lru_cache(maxsize=256)(self._search_uncached)
+        self._built = True
+
+        if path:
+            try:
+                self.save(path)
+                _prune_cache(self.cache_dir, _CACHE_MAX_FILES)
+            except Exception:
+                pass  # disk cache is best-effort
+
+    def corpus_digest(self) -> str:
+        h = hashlib.sha1(f"v{_CACHE_VERSION}|{self.chunk_size}|{self.chunk_overlap}".encode())
+        # Real file names are part of the key: chunk_ids are lowercased/collapsed, so two
+        # files differing only in name would otherwise share (and cite) one cached index
+        for key in sorted(f"{c.source}\0{c.page}\0{c.chunk_id}\0{c.text}" for c in self._chunks):
+            h.update(key.encode("utf-8", "surrogatepass"))
+            h.update(b"\1")
+        return h.hexdigest()
+
+    def save(self, path: str):
+        if not self._built:
+            raise RuntimeError("Index not built. Call build() first.")
+        import joblib
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        state = {
+            "version": _CACHE_VERSION,
+            "chunk_size": self.chunk_size,
+            "chunk_overlap": self.chunk_overlap,
+            "chunks": self._chunks,
+            "docs": self._doc_order,
+            "sparse": self._sparse,
+            "tfidf": self._tfidf,
+        }
+        # Write-then-rename so concurrent sessions never read a half-written file
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        os.close(fd)
+        try:
+            joblib.dump(state, tmp, compress=3)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    @classmethod
+    def load(cls, path: str, cache_dir: str | None = None) -> "RAGIndex":
+        state = _load_state(path)
+        idx = cls(chunk_size=state["chunk_size"], chunk_overlap=state["chunk_overlap"], cache_dir=cache_dir)
+        idx._set_state(state)
+        return idx
+
+    def _set_state(self, state: Dict[str, Any]):
+        self.chunk_size = state["chunk_size"]
+        self.chunk_overlap = state["chunk_overlap"]
+        self._chunks = state["chunks"]
+        self._reset_docs()
+        for name in state["docs"]:
+            self._add_doc(name)
+        for c in self._chunks:
+            self._chunks_by_doc[c.source].append(c)
+        self._sparse = state["sparse"]
+        self._tfidf = state["tfidf"]
+        self._search_cached = functools.lru_cache(maxsize=256)(self._search_uncached)
         self._built = True
 
     def stats(self) -> Dict[str, Any]:
         return {
-            "documents": len(set(self._docs)),
+            "documents": len(self._doc_set),
             "chunks": len(self._chunks),
             "chunk_size": self.chunk_size,
             "chunk_overlap": self.chunk_overlap,
         }
 
     def list_documents(self) -> List[str]:
-        return sorted(list(set(self._docs)))
+        if self._docs_sorted is None:
+            self._docs_sorted = sorted(self._doc_order)
+        return list(self._docs_sorted)
 
     def get_chunks_for_document(self, doc_name: str) -> List[Dict[str, Any]]:
         out = []
-        for c in self._chunks:
-            if c.source == doc_name:
-                out.append({
-                    "chunk_id": c.chunk_id,
-                    "source": c.source,
-                    "page": c.page,
-                    "text": c.text,
-                    "citation": make_citation(c.source, c.page, c.chunk_id),
-                })
+        for c in self._chunks_by_doc.get(doc_name, ()):
+            out.append({
+                "chunk_id": c.chunk_id,
+                "source": c.source,
+                "page": c.page,
+                "text": c.text,
+                "citation": make_citation(c.source, c.page, c.chunk_id),
+            })
         return out
 
     def search(self, query: str, top_k: int = 5, method: RetrievalMethod = RetrievalMethod.SPARSE) -> List[Dict[str, Any]]:
         if not self._built:
             raise RuntimeError("Index not built. Call build() first.")
 
-        top_k = int(top_k)
+        hits = self._search_cached(query, int(top_k), RetrievalMethod(method))
+        # Hand out copies so callers can't mutate cached results
+        return [dict(h) for h in hits]
+
+    def _search_uncached(self, query: str, top_k: int, method: RetrievalMethod) -> tuple:
         if method == RetrievalMethod.SPARSE:
             hits = self._sparse.search(query, top_k=top_k)
         else:
@@ -111,7 +279,7 @@ class RAGIndex:
                 "score": float(h["score"]),
                 "citation": make_citation(h["source"], h.get("page"), h["chunk_id"]),
             })
-        return results
+        return tuple(results)
 
 
 def build_answer_from_evidence(question: str, evidence: List[Dict[str, Any]], max_sentences: int = 6) -> str:
@@ -125,7 +293,7 @@ def build_answer_from_evidence(question: str, evidence: List[Dict[str, Any]], ma
     for e in evidence:
         sents = _split_sentences(e["text"])
         for s in sents:
-            clean = s.strip()
+            clean = " ".join(s.split())  # chunks keep paragraph breaks; answers are one line per bullet
             if len(clean) < 40:
                 continue
             sent_pool.append((clean, e["citation"], e["score"]))
@@ -167,33 +335,118 @@ def build_answer_from_evidence(question: str, evidence: List[Dict[str, Any]], ma
 
 
 # ---------------- helpers ----------------
+def _load_state(path: str) -> Dict[str, Any]:
+    import joblib
+    state = joblib.load(path)
+    if not isinstance(state, dict) or state.get("version") != _CACHE_VERSION:
+        raise ValueError(f"Incompatible index cache file: {path}")
+    return state
+
+
+def _prune_cache(cache_dir: str, keep: int):
+    # Bounded disk use on a shared server: keep only the `keep` newest index files by mtime
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".joblib"):
+            path = os.path.join(cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                pass  # removed by a concurrent prune
+    entries.sort(reverse=True)
+    for _, path in entries[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _pool_context():
+    # forkserver, not fork: by the second build this process already has numba/BLAS
+    # worker threads, and forking a threaded process can deadlock the children.
+    # An explicit preload list keeps the server itself from importing __main__ (workers
+    # still do; hence the parallel opt-in on add_pdfs_from_bytes). Workers need pdf_parser.
+    ctx = multiprocessing.get_context("forkserver")
+    ctx.set_forkserver_preload(["pdf_parser"])
+    return ctx
+
+
+def _extract_pages_many(datas: List[bytes], page_cache: PageStore | None = None,
+                        parallel: bool = False) -> List[List[str]]:
+    keys = [hashlib.sha1(d).hexdigest() for d in datas] if page_cache is not None else None
+    out = [page_cache.get(k) for k in keys] if keys else [None] * len(datas)
+    missing = [i for i, pages in enumerate(out) if pages is None]
+
+    extracted = None
+    # Extraction is CPU-bound and independent per PDF: fan out to processes.
+    # Windows has no forkserver (only spawn, which re-imports __main__); stay serial there.
+    workers = min(len(missing), os.cpu_count() or 1)
+    if parallel and workers > 1 and sys.platform != "win32":
+        try:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=_pool_context()) as pool:
+                extracted = list(pool.map(extract_pdf_pages_text, [datas[i] for i in missing]))
+        except Exception:
+            extracted = None
+    if extracted is None:
+        extracted = [extract_pdf_pages_text(datas[i]) for i in missing]
+
+    for i, pages in zip(missing, extracted):
+        out[i] = pages
+        if keys:
+            page_cache[keys[i]] = pages
+    return out
+
+
 def _chunk_text(text: str, size: int, overlap: int):
-    text = re.sub(r"\s+", " ", text).strip()
-    if not text:
-        return []
-    if size <= 0:
-        return [text]
+    # Generator: chunks are consumed one at a time by the caller.
+    # Blank-line-separated paragraphs are packed greedily up to `size` chars with no
+    # overlap (they're already semantic units); only a paragraph longer than `size`
+    # falls back to the overlapping sliding window.
+    buf = []
+    buf_len = 0
+    for para in _PARA_RE.split(text):
+        # str.split() collapses every whitespace run in one C-level pass (no regex)
+        para = " ".join(para.split())
+        if not para:
+            continue
+        if size > 0 and len(para) > size:
+            if buf:
+                yield "\n\n".join(buf)
+                buf, buf_len = [], 0
+            yield from _sliding_window(para, size, overlap)
+            continue
+        added = len(para) + (2 if buf else 0)
+        if buf and size > 0 and buf_len + added > size:
+            yield "\n\n".join(buf)
+            buf, buf_len = [para], len(para)
+        else:
+            buf.append(para)
+            buf_len += added
+    if buf:
+        yield "\n\n".join(buf)
+
+
+def _sliding_window(text: str, size: int, overlap: int):
     step = max(1, size - max(0, overlap))
-    chunks = []
     for start in range(0, len(text), step):
         end = min(len(text), start + size)
         chunk = text[start:end]
         if chunk.strip():
-            chunks.append(chunk)
+            yield chunk
         if end >= len(text):
             break
-    return chunks
 
 
 def _safe_id(name: str) -> str:
-    return re.sub(r"[^a-zA-Z0-9]+", "-", name).strip("-").lower()
+    return _SAFE_ID_RE.sub("-", name).strip("-").lower()
 
 
 def _split_sentences(text: str):
     # Conservative splitter for lecture notes / math
-    parts = re.split(r"(?<=[.!?])\s+(?=[A-Z0-9(])", text.strip())
+    parts = _SENT_RE.split(text.strip())
     return [p.strip() for p in parts if p.strip()]
 
 
 def _tokenize(s: str):
-    return re.findall(r"[a-zA-Z]+", s.lower())
+    return _TOK_RE.findall(s.lower())
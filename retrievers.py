@@ -1,18 +1,95 @@
 from __future__ import annotations
 from typing import List, Dict, Any
 import re
+import threading
+
+try:
+    # Optional: JIT-compiled overlap kernel; without numba the scipy matvec is used
+    import numba
+    from numba import prange
+except Exception:
+    numba = None
+    prange = range
+
+# Max distinct query strings whose TF-IDF vectors are memoized per retriever
+_QV_CACHE_SIZE = 256
+# Corpus size (chunks) from which TfidfRetriever switches to feature hashing
+_HASHING_MIN_DOCS = 5000
+_TOK_RE = re.compile(r"[a-zA-Z]+")
 
 class SparseKeywordRetriever:
     """
     Very simple baseline: keyword overlap count (no BM25).
+    Scores are computed as one sparse matvec against a binary term-document matrix.
+    `chunks` is the index's own chunk list (objects with chunk_id/source/page/text);
+    it is referenced, not copied, and text is only read back for the top-k hits.
     """
-    def __init__(self, texts: List[str], metas: List[Dict[str, Any]]):
-        self.texts = texts
-        self.metas = metas
-        self._tokens = [set(_tok(t)) for t in texts]
+    def __init__(self, chunks: List[Any]):
+        self._chunks = chunks
+        self._vec = None
+        self._X = None
+        self._tokens = None
+        self._vocab: Dict[str, int] = {}
+        self._indptr = None
+        self._indices = None
+
+        try:
+            import numpy as np
+            from sklearn.feature_extraction.text import CountVectorizer
+            self._vec = CountVectorizer(binary=True, token_pattern=r"[a-zA-Z]+", lowercase=True)
+            self._X = self._vec.fit_transform(c.text for c in chunks).astype(np.float32).tocsr()
+        except Exception:
+            # No sklearn (or empty vocabulary): fall back to per-chunk token sets,
+            # interned to small ints so intersections hash ints rather than strings
+            self._vec = None
+            self._X = None
+            vocab = self._vocab
+            self._tokens = [frozenset(vocab.setdefault(w, len(vocab)) for w in _tok(c.text)) for c in chunks]
+
+        if self._X is not None and _overlap_scores is not None:
+            try:
+                import numpy as np
+                # Flat per-doc token ids (sorted within each doc) for the numba kernel
+                self._X.sort_indices()
+                self._indptr = self._X.indptr.astype(np.int64)
+                self._indices = self._X.indices.astype(np.int32)
+                # Compile now so the first query doesn't pay the JIT cost
+                with _KERNEL_LOCK:
+                    _overlap_scores(self._indptr, self._indices, np.zeros(0, dtype=np.int32),
+                                    np.zeros(len(chunks), dtype=np.float32))
+            except Exception:
+                # JIT unavailable on this platform: keep the scipy matvec
+                self._indptr = None
+                self._indices = None
 
     def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        q = set(_tok(query))
+        if self._X is None:
+            return self._search_sets(query, top_k=top_k)
+
+        import numpy as np
+        qv = self._vec.transform([query])
+        # _indptr can outlive the kernel: an index pickled where numba was installed
+        # and loaded where it is not
+        if self._indptr is not None and _overlap_scores is not None:
+            q_ids = np.unique(qv.indices).astype(np.int32)
+            scores = np.zeros(self._X.shape[0], dtype=np.float32)
+            with _KERNEL_LOCK:
+                _overlap_scores(self._indptr, self._indices, q_ids, scores)
+        else:
+            scores = (self._X @ qv.T).toarray().ravel()
+        out = []
+        for i in _top_k_indices(scores, top_k):
+            score = float(scores[i])
+            if score <= 0:
+                continue
+            out.append(_hit(self._chunks[i], score))
+        return out
+
+    def _search_sets(self, query: str, top_k: int) -> List[Dict[str, Any]]:
+        vocab = self._vocab
+        q = frozenset(vocab[w] for w in _tok(query) if w in vocab)
+        if not q:
+            return []
         scored = []
         for i, toks in enumerate(self._tokens):
             overlap = len(q & toks)
@@ -20,67 +97,181 @@ class SparseKeywordRetriever:
                 continue
             scored.append((float(overlap), i))
         scored.sort(key=lambda x: x[0], reverse=True)
-        out = []
-        for score, i in scored[:top_k]:
-            meta = self.metas[i]
-            out.append({
-                "chunk_id": meta["chunk_id"],
-                "source": meta["source"],
-                "page": meta.get("page"),
-                "score": score,
-                "text": self.texts[i],
-            })
-        return out
+        return [_hit(self._chunks[i], score) for score, i in scored[:top_k]]
 
 
 class TfidfRetriever:
     """
     Lightweight semantic baseline using TF-IDF cosine similarity.
+    Large corpora use a stateless HashingVectorizer + TfidfTransformer (no vocabulary
+    dict to build or hold); small ones keep the exact-vocabulary TfidfVectorizer.
     """
-    def __init__(self, texts: List[str], metas: List[Dict[str, Any]]):
-        self.texts = texts
-        self.metas = metas
+    def __init__(self, chunks: List[Any], hashing: bool | None = None):
+        self._chunks = chunks
+        self._fallback = None
         self._vectorizer = None
+        self._hasher = None
+        self._transformer = None
+        self._analyze = None
+        self._vocab = None
+        self._idf = None
         self._X = None
+        self._qv_cache: Dict[str, Any] = {}
+        if hashing is None:
+            hashing = len(chunks) >= _HASHING_MIN_DOCS
 
         try:
-            from sklearn.feature_extraction.text import TfidfVectorizer
-            self._vectorizer = TfidfVectorizer(
-                lowercase=True,
-                stop_words="english",
-                ngram_range=(1, 2),
-                max_features=150000,
-            )
-            self._X = self._vectorizer.fit_transform(texts)
+            import numpy as np
+            # float32 halves the matrix size and the bytes moved per query matvec
+            if hashing:
+                from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+                self._hasher = HashingVectorizer(
+                    n_features=2 ** 18,
+                    ngram_range=(1, 2),
+                    alternate_sign=False,
+                    norm=None,
+                    lowercase=True,
+                    stop_words="english",
+                    dtype=np.float32,
+                )
+                self._transformer = TfidfTransformer()
+                self._X = self._transformer.fit_transform(self._hasher.transform(c.text for c in chunks))
+            else:
+                from sklearn.feature_extraction.text import TfidfVectorizer
+                self._vectorizer = TfidfVectorizer(
+                    lowercase=True,
+                    stop_words="english",
+                    ngram_range=(1, 2),
+                    max_features=150000,
+                    dtype=np.float32,
+                )
+                self._X = self._vectorizer.fit_transform(c.text for c in chunks)
+                # Pieces for vectorizing queries without sklearn's transform() overhead
+                self._analyze = self._vectorizer.build_analyzer()
+                self._vocab = self._vectorizer.vocabulary_
+                self._idf = self._vectorizer.idf_.astype(np.float32)
+            # Older sklearn TfidfTransformer upcasts; make sure the stored matrix is float32
+            self._X = self._X.astype(np.float32, copy=False)
+            # Unit rows once, so cosine at query time is a plain sparse matvec
+            from sklearn.preprocessing import normalize
+            self._X = normalize(self._X, norm="l2", copy=False).tocsr()
         except Exception as e:
             # If sklearn isn't available, degrade gracefully
             self._vectorizer = None
+            self._hasher = None
+            self._transformer = None
+            self._analyze = None
             self._X = None
 
     def search(self, query: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        if self._vectorizer is None or self._X is None:
+        if self._X is None:
             # Fallback to sparse overlap if TF-IDF unavailable
-            return SparseKeywordRetriever(self.texts, self.metas).search(query, top_k=top_k)
+            if self._fallback is None:
+                self._fallback = SparseKeywordRetriever(self._chunks)
+            return self._fallback.search(query, top_k=top_k)
 
-        from sklearn.metrics.pairwise import cosine_similarity
-        qv = self._vectorizer.transform([query])
-        sims = cosine_similarity(qv, self._X).ravel()
-        idxs = sims.argsort()[::-1][:top_k]
+        qv = self._query_vector(query)
+        sims = (self._X @ qv.T).toarray().ravel()
         out = []
-        for i in idxs:
+        for i in _top_k_indices(sims, top_k):
             score = float(sims[i])
             if score <= 0:
                 continue
-            meta = self.metas[i]
-            out.append({
-                "chunk_id": meta["chunk_id"],
-                "source": meta["source"],
-                "page": meta.get("page"),
-                "score": score,
-                "text": self.texts[i],
-            })
+            out.append(_hit(self._chunks[i], score))
         return out
 
+    def _query_vector(self, query: str):
+        import numpy as np
+        from sklearn.preprocessing import normalize
+        qv = self._qv_cache.get(query)
+        if qv is None:
+            if len(self._qv_cache) >= _QV_CACHE_SIZE:
+                self._qv_cache.clear()
+            if self._hasher is not None:
+                qv = self._transformer.transform(self._hasher.transform([query]))
+                qv = normalize(qv.astype(np.float32, copy=False), norm="l2", copy=False)
+            else:
+                qv = self._vec_query(query)
+            self._qv_cache[query] = qv
+        return qv
+
+    def _vec_query(self, query: str):
+        """
+        Same result as normalize(vectorizer.transform([query])) for the vocabulary path,
+        built directly from analyzer -> vocab lookups -> idf weights.
+        """
+        import numpy as np
+        from scipy.sparse import csr_matrix
+        counts: Dict[int, int] = {}
+        vocab = self._vocab
+        for term in self._analyze(query):
+            j = vocab.get(term)
+            if j is not None:
+                counts[j] = counts.get(j, 0) + 1
+        cols = np.fromiter(sorted(counts), dtype=np.int32, count=len(counts))
+        data = np.fromiter((counts[j] for j in cols), dtype=np.float32, count=len(counts)) * self._idf[cols]
+        norm = float(np.sqrt(np.dot(data, data)))
+        if norm > 0:
+            data /= norm
+        indptr = np.array([0, len(cols)], dtype=np.int32)
+        return csr_matrix((data, cols, indptr), shape=(1, len(self._idf)))
+
+
+def _hit(chunk: Any, score: float) -> Dict[str, Any]:
+    return {
+        "chunk_id": chunk.chunk_id,
+        "source": chunk.source,
+        "page": chunk.page,
+        "score": score,
+        "text": chunk.text,
+    }
+
+
+def _overlap_scores_impl(indptr, indices, q_ids, out):
+    # out[d] = |tokens(d) ∩ q_ids|, via a two-pointer merge of two sorted id arrays
+    for d in prange(out.shape[0]):
+        i = indptr[d]
+        end = indptr[d + 1]
+        j = 0
+        n = 0
+        while i < end and j < q_ids.shape[0]:
+            a = indices[i]
+            b = q_ids[j]
+            if a == b:
+                n += 1
+                i += 1
+                j += 1
+            elif a < b:
+                i += 1
+            else:
+                j += 1
+        out[d] = n
+
+
+_overlap_scores = (
+    numba.njit(parallel=True, cache=True)(_overlap_scores_impl) if numba is not None else None
+)
+# The cached RAGIndex is shared by every Streamlit session thread, and numba's fallback
+# workqueue threading layer aborts the process on concurrent parallel launches.
+_KERNEL_LOCK = threading.Lock()
+
+
+def _top_k_indices(scores, top_k: int):
+    """
+    Indices of the top_k highest scores, best first (ties keep chunk order).
+    Uses a partial partition so only the selected k items are sorted.
+    """
+    import numpy as np
+    k = min(int(top_k), scores.size)
+    if k <= 0:
+        return []
+    # k-th largest score; take everything above it, then fill with the earliest ties
+    thr = np.partition(scores, -k)[-k]
+    above = np.flatnonzero(scores > thr)
+    tied = np.flatnonzero(scores == thr)[: k - above.size]
+    part = np.concatenate([above, tied])
+    return part[np.lexsort((part, -scores[part]))].tolist()
+
 
 def _tok(s: str):
-    return re.findall(r"[a-zA-Z]+", s.lower())
+    return _TOK_RE.findall(s.lower())
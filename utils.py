@@ -2,6 +2,13 @@ from __future__ import annotations
 import re
 from html import escape
 
+_WORD_RE = re.compile(r"[a-zA-Z]+")
+_STOP_TERMS = frozenset({
+    "the","a","an","and","or","to","of","in","on","for","is","are","be","that","this",
+    "do","does","mean","explain","how","what","which","where","used","use","typically",
+    "function","functions"
+})
+
 def make_citation(source: str, page: int | None, chunk_id: str) -> str:
     # Citation format designed for demos / reports
     if page is None:
@@ -21,25 +28,28 @@ def highlight_terms(text: str, query: str, max_terms: int = 10) -> str:
     """
     if not text:
         return ""
-    terms = _top_terms(query, max_terms=max_terms)
-    safe = escape(text)
-    # Apply longest-first to reduce partial overlaps
-    for t in sorted(set(terms), key=len, reverse=True):
-        if len(t) < 3:
-            continue
-        pattern = re.compile(rf"\\b({re.escape(t)})\\b", re.IGNORECASE)
-        safe = pattern.sub(r"<mark style='padding:0 3px; border-radius:4px;'>\\1</mark>", safe)
+    # Longest-first alternation reduces partial overlaps; one pass over the text
+    terms = sorted((t for t in _top_terms(query, max_terms=max_terms) if len(t) >= 3), key=len, reverse=True)
+    if terms:
+        # Match on the raw text, then escape matched and unmatched pieces separately,
+        # so terms like "amp" can't match inside the entities escape() produces
+        pattern = re.compile(r"\b(" + "|".join(re.escape(t) for t in terms) + r")\b", re.IGNORECASE)
+        parts = []
+        pos = 0
+        for m in pattern.finditer(text):
+            parts.append(escape(text[pos:m.start()]))
+            parts.append(f"<mark style='padding:0 3px; border-radius:4px;'>{escape(m.group(1))}</mark>")
+            pos = m.end()
+        parts.append(escape(text[pos:]))
+        safe = "".join(parts)
+    else:
+        safe = escape(text)
     # Keep it readable
-    return safe.replace("\\n", "<br/>")
+    return safe.replace("\n", "<br/>")
 
 def _top_terms(query: str, max_terms: int = 10):
-    words = re.findall(r"[a-zA-Z]+", query.lower())
-    stop = {
-        "the","a","an","and","or","to","of","in","on","for","is","are","be","that","this",
-        "do","does","mean","explain","how","what","which","where","used","use","typically",
-        "function","functions"
-    }
-    words = [w for w in words if w not in stop]
+    words = _WORD_RE.findall(query.lower())
+    words = [w for w in words if w not in _STOP_TERMS]
     # Keep order but unique
     out = []
     for w in words: